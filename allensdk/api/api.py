@@ -421,7 +421,7 @@ def stream_zip_directory_over_http(url, directory, members=None, timeout=(9.05,
     zipper.close()
 
 
-def stream_file_over_http(url, file_path, timeout=(9.05, 31.1)):
+def stream_file_over_http(url, file_path, timeout=(9.05, 31.1), chunksize=1024 * 1024):
     ''' Supply an http get request and stream the response to a file.
 
     Parameters
@@ -433,6 +433,9 @@ def stream_file_over_http(url, file_path, timeout=(9.05, 31.1)):
     timeout : float or tuple of float, optional
         Specify a timeout for the request. If a tuple, specify seperate connect 
         and read timeouts.
+    chunksize : int, optional
+        Write the response to the file in pieces of this many bytes. Large files (e.g. 
+        grid data volumes) download much faster with large chunks. Default is 1 MiB.
 
     '''
 
@@ -440,4 +443,4 @@ def stream_file_over_http(url, file_path, timeout=(9.05, 31.1)):
 
         response.raise_for_status()
         with open(file_path, 'wb') as fil:
-            stream.stream_response_to_file(response, path=fil)
+            stream.stream_response_to_file(response, path=fil, chunksize=chunksize)
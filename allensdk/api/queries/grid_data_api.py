@@ -34,10 +34,38 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 
+import os
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import nrrd
+from six.moves.urllib.parse import quote
+
+from allensdk.config.manifest import Manifest
 from allensdk.deprecated import deprecated
 from .rma_api import RmaApi
 
 
+# numpy dtypes of the NRRD "type" field spellings
+_NRRD_TYPES = {
+    'signed char': 'i1', 'int8': 'i1', 'int8_t': 'i1',
+    'uchar': 'u1', 'unsigned char': 'u1', 'uint8': 'u1', 'uint8_t': 'u1',
+    'short': 'i2', 'short int': 'i2', 'signed short': 'i2',
+    'signed short int': 'i2', 'int16': 'i2', 'int16_t': 'i2',
+    'ushort': 'u2', 'unsigned short': 'u2', 'unsigned short int': 'u2',
+    'uint16': 'u2', 'uint16_t': 'u2',
+    'int': 'i4', 'signed int': 'i4', 'int32': 'i4', 'int32_t': 'i4',
+    'uint': 'u4', 'unsigned int': 'u4', 'uint32': 'u4', 'uint32_t': 'u4',
+    'longlong': 'i8', 'long long': 'i8', 'long long int': 'i8',
+    'signed long long': 'i8', 'signed long long int': 'i8', 'int64': 'i8',
+    'int64_t': 'i8',
+    'ulonglong': 'u8', 'unsigned long long': 'u8',
+    'unsigned long long int': 'u8', 'uint64': 'u8', 'uint64_t': 'u8',
+    'float': 'f4',
+    'double': 'f8'
+}
+
+
 class GridDataApi(RmaApi):
     '''HTTP Client for the Allen 3-D Expression Grid Data Service.
 
@@ -83,7 +111,7 @@ class GridDataApi(RmaApi):
 
         '''
 
-        include = '?include={}'.format(volume_type)
+        include = query_clause([('include', volume_type)])
         url = ''.join([self.grid_data_endpoint, '/download/', str(section_data_set_id), include])
         self.retrieve_file_over_http(url, path, zipped=True)
 
@@ -112,8 +140,7 @@ class GridDataApi(RmaApi):
         -----
         '''
         if include is not None:
-            include_clause = ''.join(['?include=',
-                                      ','.join(include)])
+            include_clause = query_clause([('include', ','.join(include))])
         else:
             include_clause = ''
 
@@ -153,15 +180,12 @@ class GridDataApi(RmaApi):
         params_list = []
 
         if image is not None:
-            params_list.append('image=' + ','.join(image))
+            params_list.append(('image', ','.join(image)))
 
         if resolution is not None:
-            params_list.append('resolution=%d' % (resolution))
+            params_list.append(('resolution', '%d' % (resolution)))
 
-        if len(params_list) > 0:
-            params_clause = '?' + '&'.join(params_list)
-        else:
-            params_clause = ''
+        params_clause = query_clause(params_list)
 
         url = ''.join([self.grid_data_endpoint,
                        '/download_file/',
@@ -172,3 +196,121 @@ class GridDataApi(RmaApi):
             save_file_path = str(section_data_set_id) + '.nrrd'
 
         self.retrieve_file_over_http(url, save_file_path)
+
+    def download_many(self,
+                      section_data_set_ids,
+                      image=None,
+                      resolution=None,
+                      save_dir='.',
+                      max_workers=8):
+        '''Download projection grid data for several experiments at once.  Each
+        download spends nearly all of its time waiting on the network, so they
+        are run concurrently in a pool of threads.
+
+        Parameters
+        ----------
+        section_data_set_ids : list of integers
+            What to download.
+        image : list of strings, optional
+            Image volume. See download_projection_grid_data.
+        resolution : integer, optional
+            in microns. 10, 25, 50, or 100 (default).
+        save_dir : string, optional
+            Directory to save the files in, each named <section_data_set_id>.nrrd.
+            It is created if it does not exist.
+        max_workers : integer, optional
+            Number of downloads to run simultaneously.
+
+        Returns
+        -------
+        list of strings
+            The downloaded file paths, in the order of section_data_set_ids.
+        '''
+        Manifest.safe_mkdir(save_dir)
+
+        save_file_paths = [ os.path.join(save_dir, str(section_data_set_id) + '.nrrd')
+                            for section_data_set_id in section_data_set_ids ]
+
+        def download(args):
+            section_data_set_id, save_file_path = args
+            self.download_projection_grid_data(section_data_set_id,
+                                               image=image,
+                                               resolution=resolution,
+                                               save_file_path=save_file_path)
+
+        pool = ThreadPool(max_workers)
+        try:
+            pool.map(download, zip(section_data_set_ids, save_file_paths))
+        finally:
+            pool.close()
+            pool.join()
+
+        return save_file_paths
+
+    @staticmethod
+    def open_grid_volume(path):
+        '''Open a downloaded NRRD volume without reading it into memory.  If
+        the volume is stored uncompressed in the file itself, the data are
+        returned as a read-only memory map, so that operations on it only
+        page in the voxels they touch.  Otherwise (e.g. gzip encoding) the
+        file is read with nrrd.read.  Big-endian volumes are mapped with a
+        non-native byte order.
+
+        Parameters
+        ----------
+        path : string
+            Path of an NRRD file, e.g. from download_projection_grid_data.
+
+        Returns
+        -------
+        data : np.ndarray
+            The volume, indexed as nrrd.read indexes it.
+        header : dict
+            The NRRD header.
+        '''
+        with open(path, 'rb') as f:
+            header = nrrd.read_header(f)
+            data_offset = f.tell()
+
+        def field(*names):
+            return next((header[n] for n in names if n in header), None)
+
+        mappable = (header.get('encoding') == 'raw' and
+                    header.get('type') in _NRRD_TYPES and
+                    field('data file', 'datafile') is None and
+                    int(field('line skip', 'lineskip') or 0) == 0 and
+                    int(field('byte skip', 'byteskip') or 0) == 0)
+
+        if not mappable:
+            return nrrd.read(path)
+
+        dtype = np.dtype(_NRRD_TYPES[header['type']])
+        if dtype.itemsize > 1:
+            dtype = dtype.newbyteorder('>' if header['endian'] == 'big' else '<')
+
+        data = np.memmap(path, dtype=dtype, mode='r', offset=data_offset,
+                         shape=tuple(int(s) for s in header['sizes']), order='F')
+
+        return data, header
+
+
+def query_clause(params):
+    ''' Build a URL query string from a list of (key, value) pairs.  Values are 
+    percent-encoded, except for the commas that separate list values.
+
+    Parameters
+    ----------
+    params : list of tuples
+        (key, value) pairs, in the order they should appear
+
+    Returns
+    -------
+    string
+        '?key=value&...', or an empty string if there are no parameters
+    '''
+
+    if len(params) == 0:
+        return ''
+
+    return '?' + '&'.join('%s=%s' % (key, quote(str(value), safe=','))
+                          for key, value in params)
@@ -40,6 +40,12 @@ import numpy as np
 import nrrd
 import six
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
 
 class MouseConnectivityApi(ReferenceSpaceApi, GridDataApi):
     '''
@@ -489,17 +495,74 @@ class MouseConnectivityApi(ReferenceSpaceApi, GridDataApi):
 
         '''
 
-        # find all voxels with injection_fraction > 0
-        injection_voxels = np.nonzero(injection_fraction)
-        injection_density_computed = np.multiply(injection_density[injection_voxels],
-                                                 injection_fraction[injection_voxels])
+        # with numba, 3-D volumes are reduced in a single pass without
+        # allocating the weighted volume.  numba only types native-endian
+        # numeric arrays, so anything else takes the numpy path.
+        if HAS_NUMBA and injection_density.ndim == 3 and \
+                injection_density.shape == injection_fraction.shape and \
+                _numba_compatible(injection_density) and \
+                _numba_compatible(injection_fraction):
+            sum_density, mx, my, mz = _injection_centroid_moments(
+                injection_density, injection_fraction)
+
+            if sum_density > 0:
+                return np.array([mx, my, mz]) / sum_density * resolution
+            else:
+                return None
+
+        # weight only the voxels with injection_fraction != 0, so that
+        # non-finite densities outside the injection are ignored
+        injection_voxels = injection_fraction != 0
+        injection_density_computed = np.multiply(
+            injection_density, injection_fraction, where=injection_voxels,
+            out=np.zeros(injection_voxels.shape,
+                         np.result_type(injection_density, injection_fraction)))
         sum_density = np.sum(injection_density_computed)
 
-        # compute centroid in CCF coordinates
+        # compute centroid in CCF coordinates.  the first moment along each
+        # axis only needs the weights summed over the other axes.
         if sum_density > 0:
-            centroid = np.dot(injection_density_computed,
-                              list(zip(*injection_voxels))) / sum_density * resolution
+            axes = range(injection_density_computed.ndim)
+            moments = [ np.dot(np.sum(injection_density_computed,
+                                      axis=tuple(a for a in axes if a != axis)),
+                               np.arange(injection_density_computed.shape[axis]))
+                        for axis in axes ]
+            centroid = np.array(moments) / sum_density * resolution
         else:
             centroid = None
 
         return centroid
+
+
+def _numba_compatible(arr):
+    ''' Whether an array can be passed to a numba kernel as-is. '''
+    return arr.dtype.isnative and \
+        (np.issubdtype(arr.dtype, np.integer) or
+         np.issubdtype(arr.dtype, np.floating))
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _injection_centroid_moments(injection_density, injection_fraction):
+        ''' Sum the weights (density * fraction) of a 3-D injection and their
+        first moments along each axis, in a single pass over the volume. '''
+        nx, ny, nz = injection_density.shape
+
+        sum_density = 0.0
+        mx = 0.0
+        my = 0.0
+        mz = 0.0
+
+        for i in range(nx):
+            for j in range(ny):
+                for k in range(nz):
+                    # only injected voxels count, whatever the density is elsewhere
+                    if injection_fraction[i, j, k] == 0:
+                        continue
+                    w = injection_density[i, j, k] * injection_fraction[i, j, k]
+                    sum_density += w
+                    mx += w * i
+                    my += w * j
+                    mz += w * k
+
+        return sum_density, mx, my, mz
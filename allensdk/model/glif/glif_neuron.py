@@ -36,14 +36,14 @@
 import logging
 
 import numpy as np
-import simplejson as json 
-import allensdk.core.json_utilities as ju
 import copy
 
 try:
-    from glif_neuron_methods import GlifNeuronMethod, METHOD_LIBRARY
+    from glif_neuron_methods import GlifNeuronMethod, METHOD_LIBRARY, dynamics_AScurrent_exp, dynamics_AScurrent_none
+    from glif_neuron_kernel import HAS_NUMBA, THRESHOLD_INF, kernel_arguments, run_kernel, forward_euler_block, method_function
 except:
-    from .glif_neuron_methods import GlifNeuronMethod, METHOD_LIBRARY
+    from .glif_neuron_methods import GlifNeuronMethod, METHOD_LIBRARY, dynamics_AScurrent_exp, dynamics_AScurrent_none
+    from .glif_neuron_kernel import HAS_NUMBA, THRESHOLD_INF, kernel_arguments, run_kernel, forward_euler_block, method_function
 
 class GlifBadResetException( Exception ):
     """ Exception raised when voltage is still above threshold after a reset rule is applied. """
@@ -109,8 +109,8 @@ class GlifNeuron( object ):
 
         self.type = GlifNeuron.TYPE
         self.El = El
+        self.asc_tau_array = asc_tau_array
         self.dt = dt
-        self.asc_tau_array = np.array(asc_tau_array)
         
         self.R_input = R_input
         self.C = C
@@ -126,12 +126,11 @@ class GlifNeuron( object ):
         self.init_threshold = init_threshold
         self.init_AScurrents = init_AScurrents
 
-        assert len(asc_tau_array) == len(asc_amp_array), Exception("After-spike current vector must have same length as asc_tau_array (%d vs %d)" % (asc_amp_array, asc_tau_array))
-        assert len(self.init_AScurrents) == len(self.asc_tau_array), Exception("init_AScurrents length (%d) must have same length as asc_tau_array (%d)" % (len(self.init_AScurrents), len(self.asc_tau_array)))
+        assert len(asc_tau_array) == len(asc_amp_array), "After-spike current vector must have same length as asc_tau_array (%d vs %d)" % (len(asc_amp_array), len(asc_tau_array))
+        assert len(self.init_AScurrents) == len(self.asc_tau_array), "init_AScurrents length (%d) must have same length as asc_tau_array (%d)" % (len(self.init_AScurrents), len(self.asc_tau_array))
 
 
         # values computed based on inputs
-        self.k = 1.0 / self.asc_tau_array
         self.G = 1.0 / self.R_input
 
         # Values that can be fit: They scale the input values.  
@@ -160,8 +159,48 @@ class GlifNeuron( object ):
         self.threshold_reset_method = self.configure_library_method('threshold_reset_method', threshold_reset_method)
 
     def __str__(self):
+        # serialization is rarely needed during simulation, so defer these imports
+        import simplejson as json 
+        import allensdk.core.json_utilities as ju
+
         return json.dumps(self.to_dict(), default=ju.json_handler, indent=2)
 
+    @property
+    def dt(self):
+        return self._dt
+
+    @dt.setter
+    def dt(self, value):
+        """ Set the time step and update the per-step afterspike current decay, exp(-k*dt), 
+        so that it does not need to be recomputed on every step. """
+        self._dt = value
+        self._update_asc_decay()
+
+    @property
+    def asc_tau_array(self):
+        return self._asc_tau_array
+
+    @asc_tau_array.setter
+    def asc_tau_array(self, value):
+        """ Set the afterspike current time constants, along with their inverse, k. """
+        self._asc_tau_array = np.array(value)
+        self.k = 1.0 / self._asc_tau_array
+
+    @property
+    def k(self):
+        return self._k
+
+    @k.setter
+    def k(self, value):
+        """ Set the afterspike current decay rates and update the per-step decay. """
+        self._k = value
+        self._update_asc_decay()
+
+    def _update_asc_decay(self):
+        # dt and k are both set during construction; skip until both exist
+        if hasattr(self, '_k') and hasattr(self, '_dt'):
+            self.asc_decay_per_dt = np.exp(-self._k * self._dt)
+
     @property
     def tau_m(self):
         return self.R_input*self.C
@@ -256,17 +295,17 @@ class GlifNeuron( object ):
         """
         method_options = METHOD_LIBRARY.get(method_type, None)
 
-        assert method_options is not None, Exception("Unknown method type (%s)" % method_type)
+        assert method_options is not None, "Unknown method type (%s)" % method_type
         
         method_name = params.get('name', None)
         method_params = params.get('params', None)
         
-        assert method_name is not None, Exception("Method configuration for %s has no 'name'" % (method_type))
-        assert method_params is not None, Exception("Method configuration for %s has no 'params'" % (method_params))
+        assert method_name is not None, "Method configuration for %s has no 'name'" % (method_type)
+        assert method_params is not None, "Method configuration for %s has no 'params'" % (method_type)
         
         method = method_options.get(method_name, None)
         
-        assert method is not None, Exception("unknown method name %s of type %s" % (method_name, method_type))
+        assert method is not None, "unknown method name %s of type %s" % (method_name, method_type)
         
         return GlifNeuron.configure_method(method_name, method, method_params)
 
@@ -285,8 +324,8 @@ class GlifNeuron( object ):
             the current value of the current injection into the neuron
         time_step : int
             the current time step of the neuron simulation
-        spike_time_steps : list
-            a list of all of the time steps of spikes in the neuron
+        spike_time_steps : np.ndarray
+            the time steps of all spikes in the neuron so far, as an int64 view whose length is the spike count
 
         Returns
         -------
@@ -329,16 +368,24 @@ class GlifNeuron( object ):
 
         return voltage_t1, threshold_t1, AScurrents_t1, bad_reset_flag
     
-    def run(self, stim):
+    def run(self, stim, state_out=None):
         """ Run neuron simulation over a given stimulus. This steps through the stimulus applying dynamics equations.
         After each step it checks if voltage is above threshold.  If so, self.spike_cut_length NaNs are inserted 
         into the output voltages, reset rules are applied to the voltage, threshold, and afterspike currents, and the 
         simulation resumes.
 
+        If the neuron's dynamics and reset rules are supported by glif_neuron_kernel.py, the time step 
+        loop runs as a compiled kernel instead (if numba is installed) or is integrated in blocks between
+        spikes (see `run_vectorized`).
+
         Parameters
         ----------
         stim : np.ndarray
             vector of scalar current values
+        state_out : np.ndarray, optional
+            buffer to write the voltage, threshold, and afterspike currents into (see `state_buffer`).
+            The returned outputs are views into it, so it can be reused across runs whose outputs 
+            are no longer needed.  By default a new buffer is allocated.
 
         Returns
         -------
@@ -362,85 +409,121 @@ class GlifNeuron( object ):
 
         self.threshold_components = None  #get rid of lingering method data
 
+        kernel_args = kernel_arguments(self)
+        if kernel_args is not None:
+            if HAS_NUMBA:
+                return self.run_compiled(stim, kernel_args, state_out=state_out)
+            elif kernel_args['threshold_method'] == THRESHOLD_INF:
+                return self.run_vectorized(stim, kernel_args, state_out=state_out)
+
         num_time_steps = len(stim) 
         num_AScurrents = len(AScurrents_t0)
         
-        # pre-allocate the output voltages, thresholds, and after-spike currents
-        voltage_out=np.empty(num_time_steps)
-        voltage_out[:]=np.nan
-        threshold_out=np.empty(num_time_steps)
-        threshold_out[:]=np.nan
-        AScurrents_out=np.empty(shape=(num_time_steps, num_AScurrents))
-        AScurrents_out[:]=np.nan        
-
-        # array that will hold spike indices
-        spike_time_steps = []
-        grid_spike_times = []
-        interpolated_spike_times = []
-        interpolated_spike_voltage = []
-        interpolated_spike_threshold = []
+        # pre-allocate the output voltages, thresholds, and after-spike currents. 
+        # they are stored side by side so each time step writes to a single row.
+        # every row is written below (the spike cuts with NaNs), so the buffer is not initialized.
+        state_out=state_buffer(num_time_steps, num_AScurrents, state_out)
+        voltage_out=state_out[:,0]
+        threshold_out=state_out[:,1]
+        AScurrents_out=state_out[:,2:]
+
+        # arrays that will hold spike indices, times, and values.  
+        # at most one spike can occur every spike_cut_length+1 time steps.
+        max_spikes = num_time_steps // (self.spike_cut_length + 1) + 1
+        spike_time_steps = np.empty(max_spikes, dtype=np.int64)
+        grid_spike_times = np.empty(max_spikes)
+        interpolated_spike_times = np.empty(max_spikes)
+        interpolated_spike_voltage = np.empty(max_spikes)
+        interpolated_spike_threshold = np.empty(max_spikes)
+        num_spikes = 0
+
+        # the spikes so far, as passed to the afterspike current dynamics method
+        prior_spike_time_steps = spike_time_steps[:num_spikes]
+
+        # bind the dynamics and reset rules to locals so the loop does not look them up on every step
+        AScurrent_dynamics_method = self.AScurrent_dynamics_method
+        voltage_dynamics_method = self.voltage_dynamics_method
+        threshold_dynamics_method = self.threshold_dynamics_method
+        AScurrent_reset_method = self.AScurrent_reset_method
+        voltage_reset_method = self.voltage_reset_method
+        threshold_reset_method = self.threshold_reset_method
+        dt = self.dt
+        spike_cut_length = self.spike_cut_length
+
+        # library afterspike current dynamics can write into a preallocated buffer.  alternate between 
+        # two so that AScurrents_t1 never overwrites AScurrents_t0.
+        AScurrents_in_place = method_function(AScurrent_dynamics_method) in (dynamics_AScurrent_exp, dynamics_AScurrent_none)
+        AScurrents_buffers = (np.empty(num_AScurrents), np.empty(num_AScurrents))
 
         time_step = 0
+        next_log_time_step = 0
         while time_step < num_time_steps:
-            if time_step % 10000 == 0:
+            if time_step >= next_log_time_step:
                 logging.info("time step %d / %d" % (time_step,  num_time_steps))
+                next_log_time_step = time_step + 10000
 
-            # compute voltage, threshold, and ascurrents at current time step
-            (voltage_t1, threshold_t1, AScurrents_t1) = self.dynamics(voltage_t0, threshold_t0, AScurrents_t0, stim[time_step], time_step, spike_time_steps) 
+            # compute voltage, threshold, and ascurrents at current time step (see self.dynamics)
+            inj = stim[time_step]
+            if AScurrents_in_place:
+                AScurrents_buffer = AScurrents_buffers[1] if AScurrents_t0 is AScurrents_buffers[0] else AScurrents_buffers[0]
+                AScurrents_t1 = AScurrent_dynamics_method(self, AScurrents_t0, time_step, prior_spike_time_steps, out=AScurrents_buffer)
+            else:
+                AScurrents_t1 = AScurrent_dynamics_method(self, AScurrents_t0, time_step, prior_spike_time_steps)
+            voltage_t1 = voltage_dynamics_method(self, voltage_t0, AScurrents_t0, inj)
+            threshold_t1 = threshold_dynamics_method(self, threshold_t0, voltage_t0, AScurrents_t0, inj)
 
             #if the voltage is bigger than the threshold record the spike and reset the values
             if voltage_t1 > threshold_t1: 
 
                 # spike_time_steps are stimulus indices when voltage surpassed threshold
-                spike_time_steps.append(time_step)
-                grid_spike_times.append(time_step * self.dt) 
-
-                # compute higher fidelity spike time/voltage/threshold by linearly interpolating 
-                interpolated_spike_times.append(interpolate_spike_time(self.dt, time_step, threshold_t0, threshold_t1, voltage_t0, voltage_t1))
-
-                interpolated_spike_time_offset = interpolated_spike_times[-1] - (time_step - 1) * self.dt
-                interpolated_spike_voltage.append(interpolate_spike_value(self.dt, interpolated_spike_time_offset, voltage_t0, voltage_t1))
-                interpolated_spike_threshold.append(interpolate_spike_value(self.dt, interpolated_spike_time_offset, threshold_t0, threshold_t1))
+                spike_time_steps[num_spikes] = time_step
+                grid_spike_times[num_spikes] = time_step * dt
+
+                # compute higher fidelity spike time/voltage/threshold by linearly interpolating.
+                # the dynamics methods return numpy scalars, which are slower to do arithmetic on than floats.
+                (interpolated_spike_times[num_spikes], 
+                 interpolated_spike_voltage[num_spikes], 
+                 interpolated_spike_threshold[num_spikes]) = interpolate_spike(dt, time_step, 
+                                                                               float(threshold_t0), float(threshold_t1), 
+                                                                               float(voltage_t0), float(voltage_t1))
+
+                num_spikes += 1
+                prior_spike_time_steps = spike_time_steps[:num_spikes]
             
-                # reset voltage, threshold, and afterspike currents
+                # reset voltage, threshold, and afterspike currents (see self.reset)
                 # Note that these values are not ever recorded unless the spike cut length doesnt happen (this doesnt seem quite right)
-                (voltage_t0, threshold_t0, AScurrents_t0, bad_reset_flag) = self.reset(voltage_t1, threshold_t1, AScurrents_t1) 
+                AScurrents_t0 = AScurrent_reset_method(self, AScurrents_t1)
+                voltage_t0 = voltage_reset_method(self, voltage_t1)
+                threshold_t0 = threshold_reset_method(self, threshold_t1, voltage_t0)
+                bad_reset_flag = voltage_t0 > threshold_t0
                 
                 # if we are not integrating during the spike (which includes right now), insert nans then jump ahead
                 # TODO MAYBE ONE LAST NAN SHOULD BE INSERTED AND THIS VALUE SHOULD BE RECORDED FOR CONSISTANCY
-                if self.spike_cut_length > 0:
-                    n = self.spike_cut_length
-
-                    cut_past_end = (time_step + n) >= len(voltage_out)
-                    if cut_past_end:
-                        n = len(voltage_out) - time_step
-                        
-                    voltage_out[time_step:time_step+n] = np.nan
-                    threshold_out[time_step:time_step+n] = np.nan
-                    AScurrents_out[time_step:time_step+n,:] = np.nan
-
-                    if not cut_past_end:
-                        voltage_out[time_step+n] = voltage_t0 
-                        threshold_out[time_step+n] = threshold_t0
-                        AScurrents_out[time_step+n,:] = AScurrents_t0                    
-
-                    time_step += self.spike_cut_length+1
+                if spike_cut_length:
+                    state_out[time_step:time_step+spike_cut_length] = np.nan
+                    if time_step + spike_cut_length < num_time_steps:
+                        state_out[time_step+spike_cut_length,0] = voltage_t0 
+                        state_out[time_step+spike_cut_length,1] = threshold_t0
+                        state_out[time_step+spike_cut_length,2:] = AScurrents_t0                    
+
+                    time_step += spike_cut_length+1
                 else:  
-                    voltage_out[time_step] = voltage_t0 
-                    threshold_out[time_step] = threshold_t0
-                    AScurrents_out[time_step,:] = AScurrents_t0
+                    state_out[time_step,0] = voltage_t0 
+                    state_out[time_step,1] = threshold_t0
+                    state_out[time_step,2:] = AScurrents_t0
                     time_step += 1
                     
                 if bad_reset_flag:
-                    voltage_out[time_step:time_step+5] = voltage_t0 
-                    threshold_out[time_step:time_step+5] = threshold_t0
-                    AScurrents_out[time_step:time_step+5] = AScurrents_t0
+                    state_out[time_step:time_step+5,0] = voltage_t0 
+                    state_out[time_step:time_step+5,1] = threshold_t0
+                    state_out[time_step:time_step+5,2:] = AScurrents_t0
+                    state_out[time_step+5:] = np.nan
                     break
             else:
                 # there was no spike, store the next voltages
-                voltage_out[time_step] = voltage_t1 
-                threshold_out[time_step] = threshold_t1
-                AScurrents_out[time_step,:] = AScurrents_t1
+                state_out[time_step,0] = voltage_t1 
+                state_out[time_step,1] = threshold_t1
+                state_out[time_step,2:] = AScurrents_t1
 
                 voltage_t0 = voltage_t1
                 threshold_t0 = threshold_t1
@@ -452,11 +535,213 @@ class GlifNeuron( object ):
             'voltage': voltage_out, 
             'threshold': threshold_out, 
             'AScurrents': AScurrents_out,
-            'grid_spike_times': np.array(grid_spike_times), 
-            'interpolated_spike_times': np.array(interpolated_spike_times), 
-            'spike_time_steps': np.array(spike_time_steps), 
-            'interpolated_spike_voltage': np.array(interpolated_spike_voltage), 
-            'interpolated_spike_threshold': np.array(interpolated_spike_threshold)
+            'grid_spike_times': grid_spike_times[:num_spikes], 
+            'interpolated_spike_times': interpolated_spike_times[:num_spikes], 
+            'spike_time_steps': spike_time_steps[:num_spikes], 
+            'interpolated_spike_voltage': interpolated_spike_voltage[:num_spikes], 
+            'interpolated_spike_threshold': interpolated_spike_threshold[:num_spikes]
+            }
+
+    def run_compiled(self, stim, kernel_args, state_out=None):
+        """ Run neuron simulation over a given stimulus using the compiled kernel in glif_neuron_kernel.py.
+        Outputs are identical to those of `run`.
+
+        Parameters
+        ----------
+        stim : np.ndarray
+            vector of scalar current values
+        kernel_args : dict
+            neuron parameters as returned by glif_neuron_kernel.kernel_arguments
+        state_out : np.ndarray, optional
+            see `run`
+
+        Returns
+        -------
+        dict
+            see `run`
+        """
+        stim = np.ascontiguousarray(stim, dtype=np.float64)
+
+        num_time_steps = len(stim)
+        num_AScurrents = len(kernel_args['AScurrents_t0'])
+        max_spikes = num_time_steps // (self.spike_cut_length + 1) + 1
+
+        state_out = state_buffer(num_time_steps, num_AScurrents, state_out)
+        voltage_out = state_out[:,0]
+        threshold_out = state_out[:,1]
+        AScurrents_out = state_out[:,2:]
+
+        spike_time_steps = np.empty(max_spikes, dtype=np.int64)
+        grid_spike_times = np.empty(max_spikes)
+        interpolated_spike_times = np.empty(max_spikes)
+        interpolated_spike_voltage = np.empty(max_spikes)
+        interpolated_spike_threshold = np.empty(max_spikes)
+
+        # one threshold component per time step, plus those appended through each spike cut
+        if kernel_args['threshold_method'] == THRESHOLD_INF:
+            max_threshold_components = 0
+        else:
+            max_threshold_components = num_time_steps + max_spikes * self.spike_cut_length
+        threshold_components_spike = np.empty(max_threshold_components)
+        threshold_components_voltage = np.empty(max_threshold_components)
+
+        num_spikes, num_threshold_components = run_kernel(stim, 
+                                                          state_out=state_out,
+                                                          spike_time_steps=spike_time_steps,
+                                                          grid_spike_times=grid_spike_times,
+                                                          interpolated_spike_times=interpolated_spike_times,
+                                                          interpolated_spike_voltage=interpolated_spike_voltage,
+                                                          interpolated_spike_threshold=interpolated_spike_threshold,
+                                                          threshold_components_spike=threshold_components_spike,
+                                                          threshold_components_voltage=threshold_components_voltage,
+                                                          **kernel_args)
+
+        if num_threshold_components > 0:
+            self.threshold_components = { 
+                'spike': threshold_components_spike[:num_threshold_components].tolist(),
+                'voltage': threshold_components_voltage[:num_threshold_components].tolist()
+                }
+
+        return {
+            'voltage': voltage_out, 
+            'threshold': threshold_out, 
+            'AScurrents': AScurrents_out,
+            'grid_spike_times': grid_spike_times[:num_spikes], 
+            'interpolated_spike_times': interpolated_spike_times[:num_spikes], 
+            'spike_time_steps': spike_time_steps[:num_spikes], 
+            'interpolated_spike_voltage': interpolated_spike_voltage[:num_spikes], 
+            'interpolated_spike_threshold': interpolated_spike_threshold[:num_spikes]
+            }
+
+    def run_vectorized(self, stim, kernel_args, min_block_length=256, state_out=None):
+        """ Run neuron simulation over a given stimulus, integrating the stretches between spikes with 
+        glif_neuron_kernel.forward_euler_block rather than one time step at a time.  Each block is 
+        integrated up to its first threshold crossing, the spike is handled exactly as in `run`, and 
+        integration resumes from the reset values.  Block lengths track the most recent inter-spike 
+        interval so that little work is discarded after a crossing.  Outputs match those of `run` 
+        up to floating point round-off.  Only the instantaneous threshold rules are supported.
+
+        Parameters
+        ----------
+        stim : np.ndarray
+            vector of scalar current values
+        kernel_args : dict
+            neuron parameters as returned by glif_neuron_kernel.kernel_arguments
+        min_block_length : int
+            smallest number of time steps to integrate at once
+        state_out : np.ndarray, optional
+            see `run`
+
+        Returns
+        -------
+        dict
+            see `run`
+        """
+        assert kernel_args['threshold_method'] == THRESHOLD_INF, "run_vectorized requires the 'inf' threshold dynamics and reset methods"
+
+        stim = np.asarray(stim, dtype=np.float64)
+
+        voltage_t0 = kernel_args['voltage_t0']
+        threshold_t0 = kernel_args['threshold_t0']
+        AScurrents_t0 = kernel_args['AScurrents_t0']
+        th = kernel_args['th']
+
+        block_args = { k: kernel_args[k] for k in ['El', 'dt', 'G', 'C', 'asc_decay'] }
+
+        num_time_steps = len(stim)
+        num_AScurrents = len(AScurrents_t0)
+
+        state_out = state_buffer(num_time_steps, num_AScurrents, state_out)
+        voltage_out = state_out[:,0]
+        threshold_out = state_out[:,1]
+        AScurrents_out = state_out[:,2:]
+
+        max_spikes = num_time_steps // (self.spike_cut_length + 1) + 1
+        spike_time_steps = np.empty(max_spikes, dtype=np.int64)
+        grid_spike_times = np.empty(max_spikes)
+        interpolated_spike_times = np.empty(max_spikes)
+        interpolated_spike_voltage = np.empty(max_spikes)
+        interpolated_spike_threshold = np.empty(max_spikes)
+        num_spikes = 0
+
+        block_length = min_block_length
+        time_step = 0
+        while time_step < num_time_steps:
+            block_end = min(time_step + block_length, num_time_steps)
+
+            voltage_block, AScurrents_block = forward_euler_block(stim[time_step:block_end], voltage_t0, AScurrents_t0, **block_args)
+
+            # argmax finds the first crossing, or returns 0 if there is none
+            crossed = voltage_block > th
+            n = int(np.argmax(crossed))
+            if not crossed[n]:
+                n = len(voltage_block)
+
+            # store the time steps before the crossing
+            state_out[time_step:time_step+n,0] = voltage_block[:n]
+            state_out[time_step:time_step+n,1] = th
+            state_out[time_step:time_step+n,2:] = AScurrents_block[:n]
+
+            if n > 0:
+                voltage_t0 = voltage_block[n-1]
+                threshold_t0 = th
+                AScurrents_t0 = AScurrents_block[n-1]
+
+            time_step += n
+
+            if n == len(voltage_block):
+                block_length *= 2
+                continue
+
+            voltage_t1 = voltage_block[n]
+            threshold_t1 = th
+            AScurrents_t1 = AScurrents_block[n]
+
+            spike_time_steps[num_spikes] = time_step
+            grid_spike_times[num_spikes] = time_step * self.dt
+
+            (interpolated_spike_times[num_spikes], 
+             interpolated_spike_voltage[num_spikes], 
+             interpolated_spike_threshold[num_spikes]) = interpolate_spike(self.dt, time_step, 
+                                                                           float(threshold_t0), float(threshold_t1), 
+                                                                           float(voltage_t0), float(voltage_t1))
+
+            num_spikes += 1
+
+            (voltage_t0, threshold_t0, AScurrents_t0, bad_reset_flag) = self.reset(voltage_t1, threshold_t1, AScurrents_t1) 
+
+            if self.spike_cut_length > 0:
+                state_out[time_step:time_step+self.spike_cut_length] = np.nan
+                if time_step + self.spike_cut_length < num_time_steps:
+                    state_out[time_step+self.spike_cut_length,0] = voltage_t0 
+                    state_out[time_step+self.spike_cut_length,1] = threshold_t0
+                    state_out[time_step+self.spike_cut_length,2:] = AScurrents_t0
+
+                time_step += self.spike_cut_length+1
+            else:  
+                state_out[time_step,0] = voltage_t0 
+                state_out[time_step,1] = threshold_t0
+                state_out[time_step,2:] = AScurrents_t0
+                time_step += 1
+
+            if bad_reset_flag:
+                state_out[time_step:time_step+5,0] = voltage_t0 
+                state_out[time_step:time_step+5,1] = threshold_t0
+                state_out[time_step:time_step+5,2:] = AScurrents_t0
+                state_out[time_step+5:] = np.nan
+                break
+
+            block_length = max(min_block_length, 2 * (n + 1))
+
+        return {
+            'voltage': voltage_out, 
+            'threshold': threshold_out, 
+            'AScurrents': AScurrents_out,
+            'grid_spike_times': grid_spike_times[:num_spikes], 
+            'interpolated_spike_times': interpolated_spike_times[:num_spikes], 
+            'spike_time_steps': spike_time_steps[:num_spikes], 
+            'interpolated_spike_voltage': interpolated_spike_voltage[:num_spikes], 
+            'interpolated_spike_threshold': interpolated_spike_threshold[:num_spikes]
             }
 
 # TODO: DEPRICATE
@@ -476,6 +761,206 @@ class GlifNeuron( object ):
             
 
 
+class GlifNeuronBatch( object ):
+    """ Simulates a batch of GlifNeurons that share a time step over the same stimulus.  Neuron properties
+    are stacked into length-N vectors (and afterspike current properties into N x K arrays) so that each
+    time step advances every neuron with a handful of vectorized numpy operations.  This is useful for 
+    evaluating many parameter sets (e.g. different coeffs) at once.  Only neurons whose dynamics and 
+    reset rules are supported by glif_neuron_kernel.py can be batched.
+
+    Parameters
+    ----------
+    neurons : list
+        GlifNeuron instances with the same dt and the same number of afterspike currents
+    """
+
+    def __init__(self, neurons):
+        self.neurons = list(neurons)
+
+        assert len(self.neurons) > 0, "A batch needs at least one neuron"
+
+        kernel_args = [ kernel_arguments(neuron) for neuron in self.neurons ]
+
+        for i, args in enumerate(kernel_args):
+            if args is None or args['threshold_method'] != THRESHOLD_INF:
+                raise Exception("Neuron %d uses dynamics or reset methods that cannot be batched" % i)
+
+        dts = set(args['dt'] for args in kernel_args)
+        if len(dts) > 1:
+            raise Exception("All neurons in a batch must have the same dt (found %s)" % sorted(dts))
+
+        num_AScurrents = set(len(args['AScurrents_t0']) for args in kernel_args)
+        if len(num_AScurrents) > 1:
+            raise Exception("All neurons in a batch must have the same number of afterspike currents (found %s)" % sorted(num_AScurrents))
+
+        def stack(key):
+            return np.array([ args[key] for args in kernel_args ])
+
+        self.dt = kernel_args[0]['dt']
+
+        self.init_voltage = stack('voltage_t0').astype(np.float64)
+        self.init_threshold = stack('threshold_t0').astype(np.float64)
+        self.init_AScurrents = stack('AScurrents_t0').reshape(len(self.neurons), -1)
+
+        self.El = stack('El')
+        self.G = stack('G')
+        self.C = stack('C')
+        self.th = stack('th')
+        self.spike_cut_length = stack('spike_cut_length').astype(np.int64)
+
+        self.asc_decay = stack('asc_decay').reshape(len(self.neurons), -1)
+        self.asc_amp = stack('asc_amp').reshape(len(self.neurons), -1)
+        self.asc_reset_r = stack('asc_reset_r').reshape(len(self.neurons), -1)
+        self.asc_reset_decay = stack('asc_reset_decay').reshape(len(self.neurons), -1)
+
+        self.voltage_a = stack('voltage_a')
+        self.voltage_b = stack('voltage_b')
+
+    def run(self, stim):
+        """ Run all neurons over a stimulus.  The results match what GlifNeuron.run returns for each
+        neuron individually.
+
+        Parameters
+        ----------
+        stim : np.ndarray
+            vector of scalar current values shared by all neurons, or an N x num_time_steps array 
+            with one stimulus per neuron
+
+        Returns
+        -------
+        list
+            one dictionary per neuron, see GlifNeuron.run
+        """
+        num_neurons = len(self.neurons)
+        num_AScurrents = self.init_AScurrents.shape[1]
+        dt = self.dt
+
+        stim = np.asarray(stim, dtype=np.float64)
+        num_time_steps = stim.shape[-1]
+
+        # a shared stimulus contributes one scalar per step.  per-neuron stimuli are stored 
+        # time-major so that each step reads one contiguous row.
+        if stim.ndim > 1:
+            stim = np.ascontiguousarray(stim.T)
+
+        state_out = np.empty(shape=(num_neurons, num_time_steps, 2 + num_AScurrents))
+
+        max_spikes = num_time_steps // (self.spike_cut_length.min() + 1) + 1
+        spike_time_steps = np.zeros((num_neurons, max_spikes), dtype=np.int64)
+        grid_spike_times = np.zeros((num_neurons, max_spikes))
+        interpolated_spike_times = np.zeros((num_neurons, max_spikes))
+        interpolated_spike_voltage = np.zeros((num_neurons, max_spikes))
+        interpolated_spike_threshold = np.zeros((num_neurons, max_spikes))
+        num_spikes = np.zeros(num_neurons, dtype=np.int64)
+
+        voltage_t0 = self.init_voltage.copy()
+        threshold_t0 = self.init_threshold.copy()
+        AScurrents_t0 = self.init_AScurrents.copy()
+
+        # neurons sit out the time steps cut after a spike, and stop entirely after a bad reset
+        resume_step = np.zeros(num_neurons, dtype=np.int64)
+        running = np.ones(num_neurons, dtype=bool)
+
+        for time_step in range(num_time_steps):
+            active = running & (resume_step <= time_step)
+            if not active.any():
+                if not running.any():
+                    break
+                continue
+
+            AScurrents_t1 = AScurrents_t0 * self.asc_decay
+            voltage_t1 = voltage_t0 + (stim[time_step] + AScurrents_t0.sum(axis=1) - self.G * (voltage_t0 - self.El)) * dt / self.C
+            threshold_t1 = self.th
+
+            spiked = active & (voltage_t1 > threshold_t1)
+            stepped = active & ~spiked
+
+            # there was no spike, store the next values
+            state_out[stepped,time_step,0] = voltage_t1[stepped]
+            state_out[stepped,time_step,1] = threshold_t1[stepped]
+            state_out[stepped,time_step,2:] = AScurrents_t1[stepped]
+
+            voltage_t0 = np.where(stepped, voltage_t1, voltage_t0)
+            threshold_t0 = np.where(stepped, threshold_t1, threshold_t0)
+            AScurrents_t0 = np.where(stepped[:,np.newaxis], AScurrents_t1, AScurrents_t0)
+
+            if not spiked.any():
+                continue
+
+            idx = np.flatnonzero(spiked)
+            spike_idx = num_spikes[idx]
+
+            spike_time_steps[idx, spike_idx] = time_step
+            grid_spike_times[idx, spike_idx] = time_step * dt
+            (interpolated_spike_times[idx, spike_idx], 
+             interpolated_spike_voltage[idx, spike_idx], 
+             interpolated_spike_threshold[idx, spike_idx]) = interpolate_spike(dt, time_step, 
+                                                                             threshold_t0[idx], threshold_t1[idx], 
+                                                                             voltage_t0[idx], voltage_t1[idx])
+            num_spikes[idx] += 1
+
+            # reset, then record the reset values at the end of the spike cut
+            voltage_t0[idx] = self.voltage_a[idx] * voltage_t1[idx] + self.voltage_b[idx]
+            threshold_t0[idx] = self.th[idx]
+            AScurrents_t0[idx] = self.asc_amp[idx] + AScurrents_t1[idx] * self.asc_reset_r[idx] * self.asc_reset_decay[idx]
+
+            record_step = time_step + self.spike_cut_length[idx]
+            for i, cut_end in zip(idx, record_step):
+                state_out[i,time_step:cut_end] = np.nan
+            recorded = record_step < num_time_steps
+            state_out[idx[recorded],record_step[recorded],0] = voltage_t0[idx[recorded]]
+            state_out[idx[recorded],record_step[recorded],1] = threshold_t0[idx[recorded]]
+            state_out[idx[recorded],record_step[recorded],2:] = AScurrents_t0[idx[recorded]]
+
+            resume_step[idx] = record_step + 1
+
+            for i in idx[voltage_t0[idx] > threshold_t0[idx]]:
+                state_out[i,resume_step[i]:resume_step[i]+5,0] = voltage_t0[i]
+                state_out[i,resume_step[i]:resume_step[i]+5,1] = threshold_t0[i]
+                state_out[i,resume_step[i]:resume_step[i]+5,2:] = AScurrents_t0[i]
+                state_out[i,resume_step[i]+5:] = np.nan
+                running[i] = False
+
+        return [ {
+            'voltage': state_out[i,:,0],
+            'threshold': state_out[i,:,1],
+            'AScurrents': state_out[i,:,2:],
+            'grid_spike_times': grid_spike_times[i,:num_spikes[i]],
+            'interpolated_spike_times': interpolated_spike_times[i,:num_spikes[i]],
+            'spike_time_steps': spike_time_steps[i,:num_spikes[i]],
+            'interpolated_spike_voltage': interpolated_spike_voltage[i,:num_spikes[i]],
+            'interpolated_spike_threshold': interpolated_spike_threshold[i,:num_spikes[i]]
+            } for i in range(num_neurons) ]
+
+
+def state_buffer(num_time_steps, num_AScurrents, state_out=None):
+    """ Return a (num_time_steps, 2 + num_AScurrents) array to hold the voltage, threshold, and 
+    afterspike currents of a simulation side by side.  If `state_out` is given it must be a C-contiguous 
+    float64 array with the right number of columns and at least num_time_steps rows; its leading rows 
+    are returned.  Otherwise a new array is allocated.  Either way, the contents are undefined. """
+    if state_out is None:
+        return np.empty(shape=(num_time_steps, 2 + num_AScurrents))
+
+    assert state_out.dtype == np.float64 and state_out.flags.c_contiguous, "state_out must be a C-contiguous float64 array"
+    assert state_out.ndim == 2 and state_out.shape[1] == 2 + num_AScurrents, "state_out must have %d columns" % (2 + num_AScurrents)
+    assert len(state_out) >= num_time_steps, "state_out has %d rows, but %d are needed" % (len(state_out), num_time_steps)
+
+    return state_out[:num_time_steps]
+
+
+def interpolate_spike(dt, time_step, threshold_t0, threshold_t1, voltage_t0, voltage_t1):
+    """ Interpolate the time, voltage, and threshold of a spike between two time steps.  This is 
+    `interpolate_spike_time` followed by `interpolate_spike_value` for voltage and threshold, sharing 
+    the intermediate terms. """
+    grid_time = time_step * dt
+    spike_time = grid_time + dt * (threshold_t0 - voltage_t0) / ((voltage_t1 - voltage_t0) - (threshold_t1 - threshold_t0))
+    frac = (spike_time - (grid_time - dt)) / dt
+
+    return (spike_time, 
+            voltage_t0 + (voltage_t1 - voltage_t0) * frac, 
+            threshold_t0 + (threshold_t1 - threshold_t0) * frac)
+
+
 def interpolate_spike_time(dt, time_step, threshold_t0, threshold_t1, voltage_t0, voltage_t1):
     """ Given two voltage and threshold values, the dt between them and the initial time step, interpolate
     a spike time within the dt interval by intersecting the two lines. """
@@ -490,7 +975,7 @@ def interpolate_spike_value(dt, interpolated_spike_time_offset, v0, v1):
 
 def line_crossing_x(dx, a0, a1, b0, b1):
     """ Find the x value of the intersection of two lines. """
-    assert type(a0) != int and type(a1) != int and type(b0) != int and type(b1) != int, Exception("Do not pass integers into this function!")
+    assert type(a0) != int and type(a1) != int and type(b0) != int and type(b1) != int, "Do not pass integers into this function!"
     return dx * (b0 - a0) / ( (a1 - a0) - (b1 - b0) )
         
 
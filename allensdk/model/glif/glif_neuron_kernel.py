@@ -0,0 +1,383 @@
+# Allen Institute Software License - This software license is the 2-clause BSD
+# license plus a third clause that prohibits redistribution for commercial
+# purposes without further permission.
+#
+# Copyright 2017. Allen Institute. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Redistributions for commercial purposes are not permitted without the
+# Allen Institute's written permission.
+# For purposes of this license, commercial purposes is the incorporation of the
+# Allen Institute's software into anything for which you will charge fees or
+# other compensation. Contact terms@alleninstitute.org for commercial licensing
+# opportunities.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+""" Fast simulation paths for the GlifNeuron.  If a neuron is configured with dynamics and reset rules 
+from the METHOD_LIBRARY that this module knows how to evaluate, GlifNeuron.run will not dispatch 
+through GlifNeuronMethod instances on every step.  With numba installed the whole time step loop 
+runs as a compiled kernel; otherwise the stretches between spikes are integrated a block at a time 
+with numpy.
+"""
+import numpy as np
+from scipy.signal import lfilter
+
+try:
+    from glif_neuron_methods import dynamics_AScurrent_exp, dynamics_AScurrent_none, \
+        dynamics_voltage_linear_forward_euler, dynamics_threshold_inf, \
+        dynamics_threshold_spike_component, dynamics_threshold_three_components_exact, \
+        reset_AScurrent_sum, reset_AScurrent_none, reset_voltage_v_before, reset_voltage_zero, \
+        reset_threshold_inf, reset_threshold_three_components
+except:
+    from .glif_neuron_methods import dynamics_AScurrent_exp, dynamics_AScurrent_none, \
+        dynamics_voltage_linear_forward_euler, dynamics_threshold_inf, \
+        dynamics_threshold_spike_component, dynamics_threshold_three_components_exact, \
+        reset_AScurrent_sum, reset_AScurrent_none, reset_voltage_v_before, reset_voltage_zero, \
+        reset_threshold_inf, reset_threshold_three_components
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """ Stand-in for numba.njit that leaves the decorated function as plain python. """
+        def decorator(f):
+            return f
+        return decorator
+
+
+# threshold rules understood by run_kernel.  only THRESHOLD_INF is supported by forward_euler_block.
+THRESHOLD_INF = 0
+THRESHOLD_SPIKE_COMPONENT = 1
+THRESHOLD_THREE_COMPONENTS = 2
+
+# positions of the scalar fitted coefficients in the array returned by coefficient_array
+COEFF_NAMES = ('th_inf', 'C', 'G', 'b', 'a')
+TH_INF_IDX, C_IDX, G_IDX, B_IDX, A_IDX = range(len(COEFF_NAMES))
+
+
+def coefficient_array(neuron):
+    """ Gather a neuron's scalar fitted coefficients into a float64 array indexed by TH_INF_IDX, 
+    C_IDX, G_IDX, B_IDX and A_IDX.  The array is built from neuron.coeffs on every call rather than 
+    cached on the neuron, since coeffs is a plain dictionary that may be updated between runs. """
+    return np.array([ neuron.coeffs[name] for name in COEFF_NAMES ], dtype=np.float64)
+
+
+def method_function(method):
+    """ Return the library function wrapped by a GlifNeuronMethod, or None if it is not a 
+    partial function (e.g. a custom method). """
+    return getattr(getattr(method, 'method', None), 'func', None)
+
+
+def kernel_arguments(neuron):
+    """ Translate a neuron's configuration into the scalar and array arguments of `run_kernel`.
+
+    Parameters
+    ----------
+    neuron : GlifNeuron
+        a configured neuron
+
+    Returns
+    -------
+    dict
+        keyword arguments for `run_kernel` (minus the stimulus and outputs), or None if 
+        the neuron uses a dynamics or reset method that the kernel does not implement.
+        The choice of method is folded into the coefficients (e.g. 'none' afterspike current
+        dynamics decay by a factor of zero) so that the kernel does not branch on it.
+    """
+
+    asc_dynamics = method_function(neuron.AScurrent_dynamics_method)
+    voltage_dynamics = method_function(neuron.voltage_dynamics_method)
+    threshold_dynamics = method_function(neuron.threshold_dynamics_method)
+    asc_reset = method_function(neuron.AScurrent_reset_method)
+    voltage_reset = method_function(neuron.voltage_reset_method)
+    threshold_reset = method_function(neuron.threshold_reset_method)
+
+    if voltage_dynamics is not dynamics_voltage_linear_forward_euler:
+        return None
+
+    num_AScurrents = len(neuron.asc_tau_array)
+    coeffs = coefficient_array(neuron)
+
+    G = neuron.G * coeffs[G_IDX]
+    C = neuron.C * coeffs[C_IDX]
+    dt = neuron.dt
+
+    # the spike and voltage components of the threshold (see neuron.threshold_components) evolve 
+    # with constant decay factors, which are computed here as the python methods compute them.
+    th_spike_decay = 0.0
+    th_voltage_phi = 0.0
+    th_voltage_decay_g = 0.0
+    th_voltage_decay_b = 0.0
+    th_voltage_a_over_b = 0.0
+    th_reset_a_spike = 0.0
+    th_reset_spike_decay = np.zeros(0)
+
+    if threshold_dynamics is dynamics_threshold_inf and threshold_reset is reset_threshold_inf:
+        threshold_method = THRESHOLD_INF
+    elif threshold_reset is reset_threshold_three_components and threshold_dynamics in (dynamics_threshold_spike_component, dynamics_threshold_three_components_exact):
+        params = neuron.threshold_dynamics_method.method.keywords
+        th_spike_decay = np.exp(-params['b_spike'] * dt)
+
+        if threshold_dynamics is dynamics_threshold_three_components_exact:
+            threshold_method = THRESHOLD_THREE_COMPONENTS
+
+            a_voltage = params['a_voltage'] * coeffs[A_IDX]
+            b_voltage = params['b_voltage'] * coeffs[B_IDX]
+
+            # leave degenerate parameters to the python methods, which raise or propagate them
+            if b_voltage == 0 or b_voltage - G / C == 0:
+                return None
+
+            th_voltage_phi = a_voltage / (b_voltage - G / C)
+            th_voltage_decay_g = np.exp(-G * dt / C)
+            th_voltage_decay_b = 1 / (np.exp(b_voltage * dt))
+            th_voltage_a_over_b = a_voltage / b_voltage
+        else:
+            threshold_method = THRESHOLD_SPIKE_COMPONENT
+
+        params = neuron.threshold_reset_method.method.keywords
+        th_reset_a_spike = params['a_spike']
+        th_reset_spike_decay = np.exp(-params['b_spike'] * (np.arange(1, neuron.spike_cut_length+1) * dt))
+    else:
+        return None
+
+    if asc_dynamics is dynamics_AScurrent_exp:
+        asc_decay = neuron.asc_decay_per_dt
+    elif asc_dynamics is dynamics_AScurrent_none:
+        asc_decay = np.zeros(num_AScurrents)
+    else:
+        return None
+
+    if asc_reset is reset_AScurrent_sum:
+        asc_amp = neuron.asc_amp_array * neuron.coeffs['asc_amp_array']
+        asc_reset_r = np.ones(num_AScurrents) * neuron.AScurrent_reset_method.method.keywords['r']
+    elif asc_reset is reset_AScurrent_none and asc_dynamics is dynamics_AScurrent_none:
+        # the 'none' reset only sees zeroed currents when the dynamics also zero them
+        asc_amp = np.zeros(num_AScurrents)
+        asc_reset_r = np.zeros(num_AScurrents)
+    else:
+        return None
+
+    if voltage_reset is reset_voltage_v_before:
+        voltage_a = neuron.voltage_reset_method.method.keywords['a']
+        voltage_b = neuron.voltage_reset_method.method.keywords['b']
+    elif voltage_reset is reset_voltage_zero:
+        voltage_a = 0.0
+        voltage_b = 0.0
+    else:
+        return None
+
+    # the arrays may alias the neuron's own (e.g. init_AScurrents), which is safe because neither 
+    # run_kernel nor forward_euler_block writes to its inputs
+    return {
+        'voltage_t0': float(neuron.init_voltage),
+        'threshold_t0': float(neuron.init_threshold),
+        'AScurrents_t0': np.asarray(neuron.init_AScurrents, dtype=np.float64),
+        'El': float(neuron.El),
+        'dt': float(dt),
+        'G': float(G),
+        'C': float(C),
+        'th': float(coeffs[TH_INF_IDX] * neuron.th_inf),
+        'threshold_method': threshold_method,
+        'th_spike_decay': float(th_spike_decay),
+        'th_voltage_phi': float(th_voltage_phi),
+        'th_voltage_decay_g': float(th_voltage_decay_g),
+        'th_voltage_decay_b': float(th_voltage_decay_b),
+        'th_voltage_a_over_b': float(th_voltage_a_over_b),
+        'th_reset_a_spike': float(th_reset_a_spike),
+        'th_reset_spike_decay': np.asarray(th_reset_spike_decay, dtype=np.float64),
+        'asc_decay': np.asarray(asc_decay, dtype=np.float64),
+        'asc_amp': np.asarray(asc_amp, dtype=np.float64),
+        'asc_reset_r': np.asarray(asc_reset_r, dtype=np.float64),
+        'asc_reset_decay': np.exp(-(neuron.k * neuron.dt * neuron.spike_cut_length)),
+        'voltage_a': float(voltage_a),
+        'voltage_b': float(voltage_b),
+        'spike_cut_length': neuron.spike_cut_length
+    }
+
+
+def forward_euler_block(stim, voltage_t0, AScurrents_t0, El, dt, G, C, asc_decay):
+    """ Integrate linear forward Euler voltage dynamics and exponential afterspike current dynamics
+    over a block of time steps, assuming that no spike occurs.  The voltage update is a first-order 
+    linear recurrence, v[n+1] = a * v[n] + drive[n], which is evaluated with a single lfilter call.
+
+    Parameters
+    ----------
+    stim : np.ndarray
+        current injection at each time step of the block
+    voltage_t0 : float
+        voltage before the first time step
+    AScurrents_t0 : np.ndarray
+        afterspike currents before the first time step
+    El, dt, G, C, asc_decay : 
+        see `kernel_arguments`
+
+    Returns
+    -------
+    tuple
+        voltage_t1 (voltage after each time step), AScurrents_t1 (afterspike currents after each time step)
+    """
+
+    num_time_steps = len(stim)
+
+    decay = asc_decay ** np.arange(num_time_steps + 1)[:, np.newaxis]
+    AScurrents = AScurrents_t0 * decay
+
+    a = 1.0 - G * dt / C
+    drive = (stim + AScurrents[:-1].sum(axis=1) + G * El) * dt / C
+    voltage_t1, _ = lfilter([1.0], [1.0, -a], drive, zi=[a * voltage_t0])
+
+    return voltage_t1, AScurrents[1:]
+
+
+@njit(cache=True)
+def run_kernel(stim, voltage_t0, threshold_t0, AScurrents_t0, El, dt, G, C, th,
+               threshold_method, th_spike_decay, th_voltage_phi, th_voltage_decay_g, th_voltage_decay_b,
+               th_voltage_a_over_b, th_reset_a_spike, th_reset_spike_decay,
+               asc_decay, asc_amp, asc_reset_r, asc_reset_decay, voltage_a, voltage_b, spike_cut_length,
+               state_out, spike_time_steps, grid_spike_times, interpolated_spike_times,
+               interpolated_spike_voltage, interpolated_spike_threshold,
+               threshold_components_spike, threshold_components_voltage):
+    """ Simulate the neuron over `stim`, filling the pre-allocated output arrays in place. 
+    This mirrors GlifNeuron.run step for step.  `state_out` holds voltage, threshold and afterspike 
+    currents in its columns (as in GlifNeuron.run), must be C-contiguous so that each time step 
+    writes one contiguous row.  Every row is written (those in spike cuts with NaNs), so it need 
+    not be initialized.  The spike arrays must be large enough to hold every spike that could occur. 
+
+    For the spike component and three component thresholds, the components of every time step are 
+    written to `threshold_components_spike` and `threshold_components_voltage` just as the python 
+    methods append them to neuron.threshold_components.  These arrays need room for one entry per 
+    time step plus `spike_cut_length` entries per spike.
+
+    The dynamics and reset rules are evaluated unconditionally and the next state is selected 
+    based on whether a spike occurred, so apart from branches on the (fixed) threshold rule, the only 
+    data-dependent branch on the common path is the (rarely taken) spike bookkeeping.
+
+    Returns
+    -------
+    tuple
+        the number of spikes written to the spike arrays, the number of threshold components written
+    """
+
+    num_time_steps = stim.shape[0]
+    num_AScurrents = AScurrents_t0.shape[0]
+
+    AScurrents_t0 = AScurrents_t0.copy()
+    AScurrents_t1 = np.empty(num_AScurrents)
+    AScurrents_reset = np.empty(num_AScurrents)
+
+    th_spike = 0.0
+    th_voltage = 0.0
+    num_threshold_components = 0
+
+    num_spikes = 0
+    time_step = 0
+    while time_step < num_time_steps:
+        # dynamics
+        AScurrents_sum = 0.0
+        for i in range(num_AScurrents):
+            AScurrents_sum += AScurrents_t0[i]
+            AScurrents_t1[i] = AScurrents_t0[i] * asc_decay[i]
+
+        voltage_t1 = voltage_t0 + (stim[time_step] + AScurrents_sum - G * (voltage_t0 - El)) * dt / C
+
+        if threshold_method == THRESHOLD_INF:
+            threshold_t1 = th
+        else:
+            th_spike = th_spike * th_spike_decay
+            if threshold_method == THRESHOLD_THREE_COMPONENTS:
+                beta = (stim[time_step] + AScurrents_sum + G * El) / G
+                th_voltage = (th_voltage_phi * (voltage_t0 - beta) * th_voltage_decay_g + 
+                              th_voltage_decay_b * (th_voltage - th_voltage_phi * (voltage_t0 - beta) - th_voltage_a_over_b * (beta - El)) + 
+                              th_voltage_a_over_b * (beta - El))
+
+            threshold_components_spike[num_threshold_components] = th_spike
+            threshold_components_voltage[num_threshold_components] = th_voltage
+            num_threshold_components += 1
+
+            threshold_t1 = th_voltage + th_spike + th
+
+        # reset
+        for i in range(num_AScurrents):
+            AScurrents_reset[i] = asc_amp[i] + AScurrents_t1[i] * asc_reset_r[i] * asc_reset_decay[i]
+        voltage_reset = voltage_a * voltage_t1 + voltage_b
+        threshold_reset = th
+
+        spiked = voltage_t1 > threshold_t1
+
+        if spiked:
+            spike_time_steps[num_spikes] = time_step
+
+            grid_time = time_step * dt
+            spike_time = grid_time + dt * (threshold_t0 - voltage_t0) / ((voltage_t1 - voltage_t0) - (threshold_t1 - threshold_t0))
+            frac = (spike_time - (grid_time - dt)) / dt
+            grid_spike_times[num_spikes] = grid_time
+            interpolated_spike_times[num_spikes] = spike_time
+            interpolated_spike_voltage[num_spikes] = voltage_t0 + (voltage_t1 - voltage_t0) * frac
+            interpolated_spike_threshold[num_spikes] = threshold_t0 + (threshold_t1 - threshold_t0) * frac
+            num_spikes += 1
+
+            # the cut time steps are not simulated
+            for j in range(time_step, min(time_step + spike_cut_length, num_time_steps)):
+                state_out[j, :] = np.nan
+
+            # the spike component decays through the spike cut and is then bumped by a_spike
+            if threshold_method != THRESHOLD_INF:
+                for j in range(spike_cut_length):
+                    threshold_components_spike[num_threshold_components] = th_spike * th_reset_spike_decay[j]
+                    threshold_components_voltage[num_threshold_components] = th_voltage
+                    num_threshold_components += 1
+
+                threshold_components_spike[num_threshold_components-1] += th_reset_a_spike
+                th_spike = threshold_components_spike[num_threshold_components-1]
+                threshold_reset = th_spike + th_voltage + th
+
+        # select the next state, then store it at the end of the spike cut (or at this step)
+        voltage_t0 = voltage_reset if spiked else voltage_t1
+        threshold_t0 = threshold_reset if spiked else threshold_t1
+        for i in range(num_AScurrents):
+            AScurrents_t0[i] = AScurrents_reset[i] if spiked else AScurrents_t1[i]
+
+        skip = spike_cut_length if spiked else 0
+        store_step = time_step + skip
+        if store_step < num_time_steps:
+            state_out[store_step, 0] = voltage_t0
+            state_out[store_step, 1] = threshold_t0
+            for i in range(num_AScurrents):
+                state_out[store_step, 2 + i] = AScurrents_t0[i]
+
+        time_step = store_step + 1
+
+        if spiked and voltage_t0 > threshold_t0:
+            for j in range(time_step, min(time_step + 5, num_time_steps)):
+                state_out[j, 0] = voltage_t0
+                state_out[j, 1] = threshold_t0
+                for i in range(num_AScurrents):
+                    state_out[j, 2 + i] = AScurrents_t0[i]
+            state_out[time_step + 5:, :] = np.nan
+            break
+
+    return num_spikes, num_threshold_components
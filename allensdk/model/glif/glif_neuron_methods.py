@@ -146,17 +146,27 @@ def min_of_line_and_zero(x,c,d):
     return np.minimum(one,two)
 
 
-def dynamics_AScurrent_exp(neuron, AScurrents_t0, time_step, spike_time_steps):
+def dynamics_AScurrent_exp(neuron, AScurrents_t0, time_step, spike_time_steps, out=None):
     """ Exponential afterspike current dynamics method takes a current at t0 and returns the current at
-    a time step later.
+    a time step later.  The decay factor exp(-k*dt) is precomputed by the neuron when dt is set.
+    If `out` is given, the result is written into it rather than a new array.
+
+    Like all afterspike current dynamics methods, this receives `spike_time_steps` as an int64 array
+    view of the spikes so far (its length is the spike count), not a Python list.
     """
 
-    return AScurrents_t0*np.exp(-neuron.k*neuron.dt)
+    return np.multiply(AScurrents_t0, neuron.asc_decay_per_dt, out=out)
         
 
-def dynamics_AScurrent_none(neuron, AScurrents_t0, time_step, spike_time_steps):
-    """ This method always returns zeros for the afterspike currents, regardless of input. """
-    return np.zeros(len(AScurrents_t0))
+def dynamics_AScurrent_none(neuron, AScurrents_t0, time_step, spike_time_steps, out=None):
+    """ This method always returns zeros for the afterspike currents, regardless of input. 
+    If `out` is given, it is zeroed and returned rather than a new array.
+    """
+    if out is None:
+        return np.zeros(len(AScurrents_t0))
+
+    out.fill(0.0)
+    return out
 
 
 def dynamics_voltage_linear_forward_euler(neuron, voltage_t0, AScurrents_t0, inj):
@@ -473,8 +483,8 @@ def reset_threshold_three_components(neuron, threshold_t0, voltage_v1, a_spike,
     spike_comp_decay=spike_component_of_threshold_exact(th_spike, b_spike, np.arange(1,neuron.spike_cut_length+1)*neuron.dt) #Note that the plus one is that one needs to know the decay and the inital condition for next starting point 
     
     #update neuron.threshold_components via pass by reference.
-    [tcs['voltage'].append(value) for value in np.ones(neuron.spike_cut_length)*th_voltage] #note that here I don't need the plus one because I am starting from zero
-    [tcs['spike'].append(value) for value in spike_comp_decay]
+    tcs['voltage'].extend([th_voltage] * neuron.spike_cut_length) #note that here I don't need the plus one because I am starting from zero
+    tcs['spike'].extend(spike_comp_decay)
     
     # add the amplitude of the spike component decay to last value of vector (reseting)
     tcs['spike'][-1]=tcs['spike'][-1]+a_spike
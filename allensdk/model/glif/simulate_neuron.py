@@ -37,14 +37,30 @@ import logging
 import time
 import argparse
 import os
+import multiprocessing as mp
+from functools import partial
 import numpy as np
 import allensdk.core.json_utilities as json_utilities
 from allensdk.core.nwb_data_set import NwbDataSet
 from allensdk.api.queries.glif_api import GlifApi
-from allensdk.model.glif.glif_neuron import GlifNeuron
+from allensdk.model.glif.glif_neuron import GlifNeuron, state_buffer
 
 DEFAULT_SPIKE_CUT_VALUE = 0.05 # 50mV
 
+_lock = None
+_worker_state_out = None
+
+def _init_worker(lock):
+    global _lock, _worker_state_out
+    _lock = lock
+    _worker_state_out = None
+
+def _simulate_sweep_in_worker(neuron, sweep_number, input_file_name, output_file_name, spike_cut_value):
+    ''' Simulate a sweep in a pool worker, reusing the worker's output buffer across sweeps. '''
+    global _worker_state_out
+    _worker_state_out = simulate_sweep_from_file(neuron, sweep_number, input_file_name, output_file_name, 
+                                                 spike_cut_value, state_out=_worker_state_out)
+
 def parse_arguments():
     ''' Use argparse to get required arguments from the command line '''
     parser = argparse.ArgumentParser(description='fit a neuron')
@@ -56,18 +72,19 @@ def parse_arguments():
     parser.add_argument('--output_ephys_file', help='output file name')
     parser.add_argument('--log_level', help='log level', default=logging.INFO)
     parser.add_argument('--spike_cut_value', help='value to fill in for spike duration', default=DEFAULT_SPIKE_CUT_VALUE, type=float)
+    parser.add_argument('--procs', help='number of sweeps to simulate simultaneously', default=1, type=int)
 
     return parser.parse_args()
 
 
-def simulate_sweep(neuron, stimulus, spike_cut_value):
+def simulate_sweep(neuron, stimulus, spike_cut_value, state_out=None):
     ''' Simulate a neuron given a stimulus and initial conditions. '''
 
     start_time = time.time()
 
     logging.debug("simulating")
 
-    data = neuron.run(stimulus)
+    data = neuron.run(stimulus, state_out=state_out)
 
     voltage = data['voltage']
     voltage[np.isnan(voltage)] = spike_cut_value
@@ -103,32 +120,75 @@ def write_sweep_response(file_name, sweep_number, response, spike_times):
     logging.debug("write time %f" % (time.time() - write_start_time))
 
 
-def simulate_sweep_from_file(neuron, sweep_number, input_file_name, output_file_name, spike_cut_value):
-    ''' Load a sweep stimulus, simulate the response, and write it out. '''
+def simulate_sweep_from_file(neuron, sweep_number, input_file_name, output_file_name, spike_cut_value, state_out=None):
+    ''' Load a sweep stimulus, simulate the response, and write it out.  The sweep is simulated into 
+    `state_out` if it is big enough (see `state_buffer`), otherwise into a new buffer.  The buffer that 
+    was used is returned, so that it can be passed back in for the next sweep. '''
 
     sweep_start_time = time.time()
 
+    # file access is serialized when sweeps are simulated in parallel
+    if _lock is not None:
+        _lock.acquire()
     try:
         data = load_sweep(input_file_name, sweep_number)
     except Exception as e:
         logging.warning("Failed to load sweep, skipping. (%s)" % str(e))
         raise
+    finally:
+        if _lock is not None:
+            _lock.release()
 
         # tell the neuron what dt should be for this sweep
     neuron.dt = 1.0 / data['sampling_rate']
 
-    sim_data = simulate_sweep(neuron, data['stimulus'], spike_cut_value)
+    num_time_steps = len(data['stimulus'])
+    num_AScurrents = len(neuron.init_AScurrents)
+    if state_out is None or len(state_out) < num_time_steps or state_out.shape[1] != 2 + num_AScurrents:
+        state_out = state_buffer(num_time_steps, num_AScurrents)
 
-    write_sweep_response(output_file_name, sweep_number, sim_data['voltage'], sim_data['interpolated_spike_times'])
+    sim_data = simulate_sweep(neuron, data['stimulus'], spike_cut_value, state_out)
+
+    if _lock is not None:
+        _lock.acquire()
+    try:
+        write_sweep_response(output_file_name, sweep_number, sim_data['voltage'], sim_data['interpolated_spike_times'])
+    finally:
+        if _lock is not None:
+            _lock.release()
 
     logging.debug("total sweep time %f" % ( time.time() - sweep_start_time ))
 
-def simulate_neuron(neuron, sweep_numbers, input_file_name, output_file_name, spike_cut_value):
+    return state_out
+
+def simulate_neuron(neuron, sweep_numbers, input_file_name, output_file_name, spike_cut_value, procs=1):
+    ''' Simulate a neuron's response to a set of sweeps.  Sweeps are independent, so with procs > 1 
+    they are simulated in a pool of worker processes (the neuron must be picklable, i.e. use module-level 
+    dynamics and reset methods).  Reading and writing the NWB files is serialized with a lock. '''
 
     start_time = time.time()
 
-    for sweep_number in sweep_numbers:
-        simulate_sweep_from_file(neuron, sweep_number, input_file_name, output_file_name, spike_cut_value)
+    if procs == 1:
+        # sweeps are written out one at a time, so they can all be simulated into one buffer
+        state_out = None
+        for sweep_number in sweep_numbers:
+            state_out = simulate_sweep_from_file(neuron, sweep_number, input_file_name, output_file_name, 
+                                                 spike_cut_value, state_out=state_out)
+    else:
+        # spawn rather than fork, so workers do not inherit the state of any threads running 
+        # in this process (python 2 can only fork)
+        ctx = mp.get_context('spawn') if hasattr(mp, 'get_context') else mp
+        lock = ctx.Lock()
+        pool = ctx.Pool(procs, initializer=_init_worker, initargs=(lock,))
+        try:
+            pool.map(partial(_simulate_sweep_in_worker, neuron, 
+                             input_file_name=input_file_name, 
+                             output_file_name=output_file_name, 
+                             spike_cut_value=spike_cut_value), 
+                     sweep_numbers)
+        finally:
+            pool.close()
+            pool.join()
 
     logging.debug("total elapsed time %f" % (time.time() - start_time))
 
@@ -180,7 +240,7 @@ def main():
     # filter out test sweeps
     sweep_numbers = [ s['sweep_number'] for s in sweeps if s['stimulus_name'] != 'Test' ]
 
-    simulate_neuron(neuron, sweep_numbers, ephys_file, output_ephys_file, args.spike_cut_value)
+    simulate_neuron(neuron, sweep_numbers, ephys_file, output_ephys_file, args.spike_cut_value, args.procs)
 
 
 
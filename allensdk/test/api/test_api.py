@@ -87,7 +87,7 @@ def test_failed_download(api):
 
 
 def test_request_timeout(api):
-    def raise_read_timeout(response, path=None):
+    def raise_read_timeout(response, path=None, chunksize=512):
         raise requests.exceptions.ReadTimeout
 
     with patch('requests.get', return_value=MagicMock()) as get_mock:
@@ -109,7 +109,7 @@ def test_request_timeout(api):
                                                     '/tmp/testfile')
 
     assert e_info.typename == 'ReadTimeout'
-    stream_mock.assert_called_with(response_mock, path=open_mock.return_value)
+    stream_mock.assert_called_with(response_mock, path=open_mock.return_value, chunksize=1024 * 1024)
     get_mock.assert_called_once_with('http://example.com/yo.jpg',
                                      stream=True,
                                      timeout=(9.05, 31.1))
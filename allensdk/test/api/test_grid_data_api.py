@@ -33,9 +33,13 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import os
 import pytest
+import numpy as np
+import nrrd
 from mock import MagicMock, patch
-from allensdk.api.queries.grid_data_api import GridDataApi
+from allensdk.api.queries.grid_data_api import GridDataApi, query_clause
+from allensdk.api.queries.mouse_connectivity_api import MouseConnectivityApi
 
 
 @pytest.fixture
@@ -130,3 +134,57 @@ def test_api_doc_url_projection_grid_injection_fraction_resolution(grid_data):
         "http://api.brain-map.org/grid_data/download_file/181777177"
         "?image=injection_fraction&resolution=25",
         path)
+
+
+def test_download_many(grid_data, tmpdir_factory):
+    save_dir = os.path.join(str(tmpdir_factory.mktemp('grid_data')), 'volumes')
+    paths = grid_data.download_many([181777177, 181777178],
+                                    [grid_data.INJECTION_FRACTION],
+                                    resolution=25,
+                                    save_dir=save_dir)
+
+    assert os.path.isdir(save_dir)
+    assert paths == [os.path.join(save_dir, '181777177.nrrd'),
+                     os.path.join(save_dir, '181777178.nrrd')]
+    assert grid_data.retrieve_file_over_http.call_count == 2
+    for section_data_set_id, path in zip([181777177, 181777178], paths):
+        grid_data.retrieve_file_over_http.assert_any_call(
+            "http://api.brain-map.org/grid_data/download_file/%d"
+            "?image=injection_fraction&resolution=25" % section_data_set_id,
+            path)
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'gzip'])
+def test_open_grid_volume(grid_data, tmpdir_factory, encoding):
+    path = str(tmpdir_factory.mktemp('grid_volume').join('volume.nrrd'))
+    volume = np.arange(60, dtype=np.float32).reshape((3, 4, 5))
+    nrrd.write(path, volume, {'encoding': encoding})
+
+    data, header = grid_data.open_grid_volume(path)
+
+    assert isinstance(data, np.memmap) == (encoding == 'raw')
+    assert np.array_equal(data, volume)
+
+
+def test_open_grid_volume_big_endian(grid_data, tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('grid_volume').join('volume.nrrd'))
+    density = np.ones((4, 5, 6), dtype=np.float32)
+    fraction = np.zeros((4, 5, 6), dtype=np.float32)
+    fraction[1, 2, 3] = 1.0
+    nrrd.write(path, fraction.astype('>f4'), {'encoding': 'raw', 'endian': 'big'})
+
+    data, header = grid_data.open_grid_volume(path)
+
+    assert isinstance(data, np.memmap)
+    assert data.dtype == np.dtype('>f4')
+    assert np.array_equal(data, fraction)
+
+    centroid = MouseConnectivityApi().calculate_injection_centroid(
+        density, data, resolution=10)
+    assert np.allclose(centroid, [10.0, 20.0, 30.0])
+
+
+def test_query_clause():
+    assert query_clause([]) == ''
+    assert query_clause([('image', 'a,b'), ('resolution', 25)]) == '?image=a,b&resolution=25'
+    assert query_clause([('include', 'x y&z')]) == '?include=x%20y%26z'
@@ -459,3 +459,45 @@ def test_calculate_injection_centroid(connectivity):
         density, fraction, resolution=25)
     
     assert np.array_equal(centroid, [37.5, 37.5])
+
+
+def test_calculate_injection_centroid_non_finite_density(connectivity):
+    # densities outside the injection do not contribute
+    density = np.ones((4, 5))
+    density[0, 0] = np.nan
+    density[3, 4] = np.inf
+    fraction = np.zeros((4, 5))
+    fraction[1, 2] = 1.0
+
+    centroid = connectivity.calculate_injection_centroid(
+        density, fraction, resolution=10)
+
+    assert np.array_equal(centroid, [10.0, 20.0])
+
+
+def test_calculate_injection_centroid_3d(connectivity):
+    density = np.ones((4, 5, 6), dtype=np.float32)
+    fraction = np.zeros((4, 5, 6), dtype=np.float32)
+    fraction[1, 2, 3] = 1.0
+    fraction[3, 4, 5] = 1.0
+
+    centroid = connectivity.calculate_injection_centroid(
+        density, fraction, resolution=10)
+
+    assert np.allclose(centroid, [20.0, 30.0, 40.0])
+    assert connectivity.calculate_injection_centroid(
+        density, np.zeros_like(fraction)) is None
+
+    # densities outside the injection do not contribute
+    nan_density = density.copy()
+    nan_density[0, 0, 0] = np.nan
+    centroid = connectivity.calculate_injection_centroid(
+        nan_density, fraction, resolution=10)
+
+    assert np.allclose(centroid, [20.0, 30.0, 40.0])
+
+    # big-endian volumes (e.g. memory-mapped from a big-endian nrrd)
+    centroid = connectivity.calculate_injection_centroid(
+        density.astype('>f4'), fraction.astype('>f4'), resolution=10)
+
+    assert np.allclose(centroid, [20.0, 30.0, 40.0])
@@ -34,12 +34,17 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import pytest
+import numpy as np
 from allensdk.api.queries.glif_api import GlifApi
 import allensdk.core.json_utilities as json_utilities
-from allensdk.model.glif.glif_neuron import GlifNeuron
+from allensdk.model.glif.glif_neuron import GlifNeuron, GlifNeuronBatch
+from allensdk.model.glif.glif_neuron_methods import dynamics_voltage_linear_forward_euler
+from allensdk.model.glif.glif_neuron_kernel import kernel_arguments
+import allensdk.model.glif.simulate_neuron as simulate_neuron_module
 from allensdk.model.glif.simulate_neuron import simulate_neuron
 from allensdk.core.nwb_data_set import NwbDataSet
 import os
+import multiprocessing as mp
 # import matplotlib.pyplot as plt
 
 
@@ -53,6 +58,28 @@ def ephys_sweeps_file(fn_temp_dir):
     return os.path.join(fn_temp_dir, "ephys_sweeps.json")
 
 
+@pytest.fixture
+def lif_asc_config():
+    return {
+        'El': 0.0, 'dt': 5e-5, 'R_input': 2e8, 'C': 1e-10,
+        'asc_tau_array': [0.01, 0.1], 'asc_amp_array': [-2e-11, 5e-12],
+        'spike_cut_length': 0, 'th_inf': 0.02, 'th_adapt': None,
+        'coeffs': {'th_inf': 1.1, 'C': 0.9},
+        'init_voltage': 0.0, 'init_threshold': 0.022, 'init_AScurrents': [0.0, 0.0],
+        'AScurrent_dynamics_method': {'name': 'exp', 'params': {}},
+        'voltage_dynamics_method': {'name': 'linear_forward_euler', 'params': {}},
+        'threshold_dynamics_method': {'name': 'inf', 'params': {}},
+        'AScurrent_reset_method': {'name': 'sum', 'params': {'r': [1.0, 1.0]}},
+        'voltage_reset_method': {'name': 'v_before', 'params': {'a': 0.5, 'b': 0.001}},
+        'threshold_reset_method': {'name': 'inf', 'params': {}}
+    }
+
+
+@pytest.fixture
+def step_stimulus():
+    return np.array([0.0] * 500 + [2e-10] * 3000 + [0.0] * 500)
+
+
 @pytest.fixture
 def glif_api():
     endpoint = None
@@ -150,6 +177,199 @@ def test_run_glifneuron(configured_glif_api, neuron_config_file):
     spike_times = output['interpolated_spike_times']
 
 
+def run_time_step_loop(neuron_config, stimulus):
+    """ Simulate with the python time step loop by hiding the voltage dynamics method from the kernel. """
+    neuron = GlifNeuron.from_dict(neuron_config)
+    neuron.voltage_dynamics_method = neuron.configure_method(
+        'custom', lambda *args: dynamics_voltage_linear_forward_euler(*args), {})
+
+    assert kernel_arguments(neuron) is None
+    return neuron.run(stimulus)
+
+
+@pytest.mark.parametrize('spike_cut_length', [0, 30])
+def test_run_compiled_matches_run(lif_asc_config, step_stimulus, spike_cut_length):
+    lif_asc_config['spike_cut_length'] = spike_cut_length
+    expected = run_time_step_loop(lif_asc_config, step_stimulus)
+
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    actual = neuron.run_compiled(step_stimulus, kernel_arguments(neuron))
+
+    assert len(expected['spike_time_steps']) > 0
+    for key, value in expected.items():
+        assert np.allclose(value, actual[key], equal_nan=True)
+
+
+@pytest.mark.parametrize('spike_cut_length', [0, 30])
+@pytest.mark.parametrize('threshold_dynamics_method', ['spike_component', 'three_components_exact'])
+def test_run_compiled_adapting_threshold(lif_asc_config, step_stimulus, spike_cut_length, threshold_dynamics_method):
+    lif_asc_config['spike_cut_length'] = spike_cut_length
+    lif_asc_config['threshold_dynamics_method'] = { 
+        'name': threshold_dynamics_method, 
+        'params': {'a_spike': 0.002, 'b_spike': 100.0, 'a_voltage': 5.0, 'b_voltage': 50.0} 
+    }
+    lif_asc_config['threshold_reset_method'] = {'name': 'three_components', 'params': {'a_spike': 0.002, 'b_spike': 100.0}}
+
+    expected_neuron = GlifNeuron.from_dict(lif_asc_config)
+    expected_neuron.voltage_dynamics_method = expected_neuron.configure_method(
+        'custom', lambda *args: dynamics_voltage_linear_forward_euler(*args), {})
+    expected = expected_neuron.run(step_stimulus)
+
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    actual = neuron.run_compiled(step_stimulus, kernel_arguments(neuron))
+
+    assert len(expected['spike_time_steps']) > 0
+    for key, value in expected.items():
+        assert np.allclose(value, actual[key], equal_nan=True)
+
+    for key, value in expected_neuron.threshold_components.items():
+        assert np.allclose(value, neuron.threshold_components[key])
+
+
+@pytest.mark.parametrize('spike_cut_length', [0, 30])
+@pytest.mark.parametrize('min_block_length', [1, 256])
+def test_run_vectorized_matches_run(lif_asc_config, step_stimulus, spike_cut_length, min_block_length):
+    lif_asc_config['spike_cut_length'] = spike_cut_length
+    expected = run_time_step_loop(lif_asc_config, step_stimulus)
+
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    actual = neuron.run_vectorized(step_stimulus, kernel_arguments(neuron), min_block_length)
+
+    assert len(expected['spike_time_steps']) > 0
+    for key, value in expected.items():
+        assert np.allclose(value, actual[key], equal_nan=True)
+
+
+def test_batch_matches_run(lif_asc_config, step_stimulus):
+    configs = []
+    for spike_cut_length in [0, 30]:
+        for th_inf_coeff in [0.8, 1.0, 1.3]:
+            config = dict(lif_asc_config, spike_cut_length=spike_cut_length,
+                          coeffs={'th_inf': th_inf_coeff})
+            configs.append(config)
+
+    neurons = [ GlifNeuron.from_dict(config) for config in configs ]
+    actual = GlifNeuronBatch(neurons).run(step_stimulus)
+
+    for neuron, neuron_actual in zip(neurons, actual):
+        expected = neuron.run(step_stimulus)
+        for key, value in expected.items():
+            assert np.allclose(value, neuron_actual[key], equal_nan=True)
+
+
+def test_bad_reset_without_spike_cut(lif_asc_config, step_stimulus):
+    lif_asc_config['voltage_reset_method'] = {'name': 'v_before', 'params': {'a': 1.0, 'b': 0.01}}
+    expected = run_time_step_loop(lif_asc_config, step_stimulus)
+
+    # the simulation stops five steps after the first spike, leaving the rest of the output NaN
+    assert len(expected['spike_time_steps']) == 1
+    last_step = expected['spike_time_steps'][0] + 5
+    assert not np.isnan(expected['voltage'][:last_step+1]).any()
+    assert last_step + 1 < len(step_stimulus)
+    assert np.isnan(expected['voltage'][last_step+1:]).all()
+    assert np.isnan(expected['AScurrents'][last_step+1:]).all()
+
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    actual_outputs = [ neuron.run_compiled(step_stimulus, kernel_arguments(neuron)),
+                       neuron.run_vectorized(step_stimulus, kernel_arguments(neuron)),
+                       GlifNeuronBatch([neuron]).run(step_stimulus)[0] ]
+
+    for actual in actual_outputs:
+        for key, value in expected.items():
+            assert np.allclose(value, actual[key], equal_nan=True)
+
+
+@pytest.mark.parametrize('spike_cut_length', [0, 30])
+def test_run_state_out(lif_asc_config, step_stimulus, spike_cut_length):
+    lif_asc_config['spike_cut_length'] = spike_cut_length
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    expected = neuron.run(step_stimulus)
+
+    state_out = np.empty((len(step_stimulus) + 100, 2 + len(neuron.init_AScurrents)))
+    state_out.fill(-1.0)
+    actual = neuron.run(step_stimulus, state_out=state_out)
+
+    assert np.shares_memory(actual['voltage'], state_out)
+    for key, value in expected.items():
+        assert np.allclose(value, actual[key], equal_nan=True)
+
+    with pytest.raises(AssertionError):
+        neuron.run(step_stimulus, state_out=state_out[:10])
+
+
+def test_update_asc_tau_array(lif_asc_config, step_stimulus):
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    neuron.asc_tau_array = [ 2 * tau for tau in lif_asc_config['asc_tau_array'] ]
+
+    expected = GlifNeuron.from_dict(dict(lif_asc_config, asc_tau_array=neuron.asc_tau_array)).run(step_stimulus)
+
+    assert np.allclose(neuron.k, 1.0 / neuron.asc_tau_array)
+    assert np.allclose(neuron.asc_decay_per_dt, np.exp(-neuron.k * neuron.dt))
+    for key, value in neuron.run(step_stimulus).items():
+        assert np.allclose(value, expected[key], equal_nan=True)
+
+
+@pytest.mark.parametrize('procs', [1, 2])
+def test_simulate_neuron(lif_asc_config, step_stimulus, monkeypatch, tmpdir, procs):
+    # spawned workers would not see the patched file access below, so fork them here.  tasks
+    # are pickled either way.
+    if procs > 1:
+        if 'fork' not in mp.get_all_start_methods():
+            pytest.skip('worker processes cannot be forked')
+        fork_context = mp.get_context('fork')
+        monkeypatch.setattr(mp, 'get_context', lambda method: fork_context)
+
+    # sweeps of different lengths, so the output buffer has to grow
+    stimuli = { 1: step_stimulus[:2000], 2: step_stimulus, 3: step_stimulus[:1000] }
+
+    def load_sweep(file_name, sweep_number):
+        return { 'stimulus': stimuli[sweep_number], 'sampling_rate': 1.0 / lif_asc_config['dt'] }
+
+    def write_sweep_response(file_name, sweep_number, response, spike_times):
+        np.save(os.path.join(file_name, 'response_%d.npy' % sweep_number), response)
+
+    monkeypatch.setattr(simulate_neuron_module, 'load_sweep', load_sweep)
+    monkeypatch.setattr(simulate_neuron_module, 'write_sweep_response', write_sweep_response)
+
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    simulate_neuron(neuron, sorted(stimuli), None, str(tmpdir), 0.05, procs=procs)
+
+    for sweep_number, stimulus in stimuli.items():
+        expected = GlifNeuron.from_dict(lif_asc_config).run(stimulus)['voltage']
+        expected[np.isnan(expected)] = 0.05
+        actual = np.load(os.path.join(str(tmpdir), 'response_%d.npy' % sweep_number))
+        assert np.allclose(actual, expected)
+
+    # a missing sweep fails the whole simulation
+    with pytest.raises(KeyError):
+        simulate_neuron(neuron, [1, 4], None, str(tmpdir), 0.05, procs=procs)
+
+
+def test_simulate_neuron_spawned_workers(lif_asc_config, tmpdir):
+    # the neuron and sweep task are pickled into spawned workers, and their errors come back
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+
+    with pytest.raises(IOError):
+        simulate_neuron(neuron, [1, 2], os.path.join(str(tmpdir), 'missing.nwb'), str(tmpdir), 0.05, procs=2)
+
+
+def test_batch_mismatched_dt(lif_asc_config):
+    neurons = [ GlifNeuron.from_dict(lif_asc_config), GlifNeuron.from_dict(dict(lif_asc_config, dt=1e-4)) ]
+
+    with pytest.raises(Exception):
+        GlifNeuronBatch(neurons)
+
+
+def test_kernel_arguments_custom_method(lif_asc_config):
+    def custom_voltage_reset_rule(neuron, voltage_t0):
+        return voltage_t0
+
+    neuron = GlifNeuron.from_dict(lif_asc_config)
+    neuron.voltage_reset_method = neuron.configure_method('custom', custom_voltage_reset_rule, {})
+
+    assert kernel_arguments(neuron) is None
+
+
 @pytest.mark.skipif(True, reason="needs nwb file")
 def test_3(configured_glif_api, neuron_config_file, ephys_sweeps_file):
     neuron_config = json_utilities.read(neuron_config_file)